@@ -2,97 +2,165 @@
 # encoding: utf-8
 
 from http.server import HTTPServer, BaseHTTPRequestHandler
-from socketserver import ThreadingMixIn
 import argparse
 import os
+import queue
+import re
+import socket
+import threading
 import webbrowser
 
+RANGE_RE = re.compile(r'^bytes=(\d+)-(\d*)$')
 
-class ThreadedHTTPServer(ThreadingMixIn, HTTPServer):
-    daemon_threads = True
+
+class ThreadPoolHTTPServer(HTTPServer):
+    request_queue_size = 128
+    max_workers = 32
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # A fixed set of daemon workers: no thread is created per connection,
+        # and an idle keep-alive connection never blocks interpreter exit.
+        self._requests = queue.SimpleQueue()
+        for _ in range(self.max_workers):
+            threading.Thread(target=self._worker, daemon=True).start()
+
+    def _worker(self):
+        while True:
+            request, client_address = self._requests.get()
+            try:
+                self.finish_request(request, client_address)
+            except Exception:
+                self.handle_error(request, client_address)
+            finally:
+                self.shutdown_request(request)
+
+    def process_request(self, request, client_address):
+        self._requests.put((request, client_address))
+
+    def get_request(self):
+        conn, addr = super().get_request()
+        # Don't let Nagle hold back the small headers of a 206 response.
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return conn, addr
 
 
 class CORSRequestHandler(BaseHTTPRequestHandler):
-    def __init__(self, *args, file_path=None, **kwargs):
+    # Under HTTP/1.1 connections persist by default, and a client's
+    # 'Connection: close' is still honoured.
+    protocol_version = 'HTTP/1.1'
+    # Each connection holds one of the server's pool workers, so idle
+    # keep-alive connections must be closed or they starve new ones.
+    timeout = 10
+
+    # Constant headers, pre-encoded so they skip send_header's per-call formatting.
+    CORS_HEADERS = (b'Access-Control-Allow-Origin: *\r\n'
+                    b'Access-Control-Allow-Methods: GET, HEAD, OPTIONS\r\n'
+                    b'Access-Control-Allow-Headers: *\r\n')
+    PARQUET_HEADERS = (b'Accept-Ranges: bytes\r\n'
+                       b'Content-Type: application/vnd.apache.parquet\r\n')
+
+    def __init__(self, *args, file_path=None, file_size=None, file_basename=None, **kwargs):
         self.file_path = file_path
+        self.file_size = file_size
+        self._expected_path = '/' + file_basename
+        self._content_disposition = (f'Content-Disposition: attachment; filename="{file_basename}"\r\n'
+                                     .encode('latin-1', 'replace'))
         super().__init__(*args, **kwargs)
 
     def log_message(self, format, *args):
         pass
 
+    def send_raw_headers(self, raw):
+        # Relies on BaseHTTPRequestHandler internals: send_response_only creates
+        # _headers_buffer (except for HTTP/0.9), and send_header appends encoded
+        # lines to it the same way. Must be called after send_response.
+        if self.request_version != 'HTTP/0.9':
+            self._headers_buffer.append(raw)
+
     def end_headers(self):
-        self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'GET, HEAD, OPTIONS')
-        self.send_header('Access-Control-Allow-Headers', '*')
+        self.send_raw_headers(self.CORS_HEADERS)
         super().end_headers()
 
     def do_OPTIONS(self):
         self.send_response(200)
+        self.send_header('Content-Length', '0')
         self.end_headers()
 
     def do_GET(self):
-        expected_path = '/' + os.path.basename(self.file_path)
-        if self.path != expected_path:
-            self.send_error(404, f"File not found. Please use {expected_path}")
+        if self.path != self._expected_path:
+            self.send_error(404, f"File not found. Please use {self._expected_path}")
             return
 
+        file_size = self.file_size
+        range_header = self.headers.get('Range')
+
+        if range_header:
+            range_match = RANGE_RE.match(range_header)
+            if not range_match:
+                self.send_error(400, 'Invalid range header')
+                return
+            range_start = int(range_match.group(1))
+            range_end = file_size - 1
+            if range_match.group(2):
+                range_end = min(int(range_match.group(2)), range_end)
+
+            if range_start >= file_size or range_end < range_start:
+                self.send_error(416, 'Requested range not satisfiable')
+                return
+
+            content_length = range_end - range_start + 1
+        else:
+            range_start = 0
+            content_length = file_size
+
         try:
-            file_size = os.path.getsize(self.file_path)
-            range_header = self.headers.get('Range')
+            f = open(self.file_path, 'rb')
+        except FileNotFoundError:
+            self.send_error(404, "File not found on server")
+            return
+        except OSError as e:
+            self.send_error(500, f"Internal server error: {str(e)}")
+            return
 
+        with f:
             if range_header:
-                try:
-                    range_match = range_header.replace('bytes=', '').split('-')
-                    range_start = int(range_match[0])
-                    range_end = int(range_match[1]) if range_match[1] else file_size - 1
-                    
-                    if range_start >= file_size:
-                        self.send_error(416, 'Requested range not satisfiable')
-                        return
-                    
-                    self.send_response(206)
-                    self.send_header('Content-Range', f'bytes {range_start}-{range_end}/{file_size}')
-                    content_length = range_end - range_start + 1
-                except ValueError:
-                    self.send_error(400, 'Invalid range header')
-                    return
+                self.send_response(206)
+                self.send_header('Content-Range', f'bytes {range_start}-{range_end}/{file_size}')
             else:
                 self.send_response(200)
-                range_start = 0
-                content_length = file_size
-
-            self.send_header('Accept-Ranges', 'bytes')
             self.send_header('Content-Length', str(content_length))
-            self.send_header('Content-type', 'application/vnd.apache.parquet')
-            self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(self.file_path)}"')
-            self.send_header("Connection", "keep-alive")
+            self.send_raw_headers(self.PARQUET_HEADERS)
+            if not range_header:
+                # Only a full download can end up saved to disk.
+                self.send_raw_headers(self._content_disposition)
             self.end_headers()
 
-            with open(self.file_path, 'rb') as f:
-                if range_header:
-                    f.seek(range_start)
-                    self.wfile.write(f.read(content_length))
-                else:
-                    self.wfile.write(f.read())
+            try:
+                self.send_file_range(f, range_start, content_length)
+            except OSError:
+                # The status line is already out, so an error can't be reported
+                # any more; drop the connection instead of reusing it mid-body.
+                self.close_connection = True
 
-        except FileNotFoundError:
-            self.send_error(404, "File not found on server")
-        except Exception as e:
-            self.send_error(500, f"Internal server error: {str(e)}")
+    def send_file_range(self, f, offset, count):
+        if not count:
+            return
+        self.wfile.flush()
+        # socket.sendfile uses os.sendfile where available and falls back to
+        # send() elsewhere; it also honours the socket timeout.
+        sent = self.connection.sendfile(f, offset, count)
+        if sent < count:
+            # The file shrank while being served, so the body is shorter than
+            # the Content-Length already sent.
+            self.close_connection = True
 
     def do_HEAD(self):
-        try:
-            file_size = os.path.getsize(self.file_path)
-            self.send_response(200)
-            self.send_header('Accept-Ranges', 'bytes')
-            self.send_header('Content-Length', str(file_size))
-            self.send_header('Content-type', 'application/vnd.apache.parquet')
-            self.send_header('Content-Disposition', f'attachment; filename="{os.path.basename(self.file_path)}"')
-            self.end_headers()
-        except FileNotFoundError:
-            self.send_error(404, "File not found on server")
-        except Exception as e:
-            self.send_error(500, f"Internal server error: {str(e)}")
+        self.send_response(200)
+        self.send_header('Content-Length', str(self.file_size))
+        self.send_raw_headers(self.PARQUET_HEADERS)
+        self.send_raw_headers(self._content_disposition)
+        self.end_headers()
 
 def main():
     parser = argparse.ArgumentParser(description='Open a local parquet file in parquet-viewer')
@@ -105,13 +173,21 @@ def main():
     args = parser.parse_args()
 
     file_name = os.path.basename(args.file)
-    handler = lambda *handler_args: CORSRequestHandler(*handler_args, file_path=args.file)
-    httpd = ThreadedHTTPServer(('127.0.0.1', args.port), handler)
+    try:
+        file_size = os.path.getsize(args.file)
+    except OSError as e:
+        parser.error(f"cannot read {args.file}: {e.strerror}")
+    # The file is not expected to change while it is being served.
+    handler = lambda *handler_args: CORSRequestHandler(*handler_args, file_path=args.file,
+                                                       file_size=file_size, file_basename=file_name)
+    httpd = ThreadPoolHTTPServer(('127.0.0.1', args.port), handler)
     url = f'https://parquet-viewer.xiangpeng.systems/?url=http://127.0.0.1:{args.port}/{file_name}'
     print(f'Opening in your browser:\n{url}')
     
     if not args.no_open:
-        webbrowser.open(url)
+        # httpd is already listening, so the browser's first request is queued
+        # even if serve_forever() has not started yet.
+        threading.Thread(target=webbrowser.open, args=(url,), daemon=True).start()
     
     httpd.serve_forever()
 